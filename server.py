@@ -1,32 +1,58 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+import orjson
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ReturnDocument, WriteConcern
+import asyncio
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import Annotated, List, Optional
+from datetime import datetime, timezone, timedelta
 import random
+from collections import deque
+from cachetools import TTLCache
 
 
+UTC = timezone.utc
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# MongoDB connection. The pool is sized well above the default so concurrent
+# requests don't serialize on connection checkout, and wire compression keeps
+# the batched insert_many payloads small
+client = AsyncIOMotorClient(
+    os.environ['MONGO_URL'],
+    maxPoolSize=500,
+    minPoolSize=50,
+    compressors="zstd",
+    retryWrites=True,
+    w=1,
+    tz_aware=True,
+    appname="noscreen",
+    uuidRepresentation="standard",
+)
 db = client[os.environ['DB_NAME']]
 
+# Session inserts are logging-like: losing a single entry if the primary dies
+# mid-write is acceptable, so the background flusher writes them without
+# waiting for acknowledgment. Updates and user_stats stay at w=1
+sessions_unacked = db.get_collection(
+    "focus_sessions", write_concern=WriteConcern(w=0))
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Motivational Quotes
-MOTIVATIONAL_QUOTES = [
+MOTIVATIONAL_QUOTES = (
     "Stay focused, be present 🌱",
     "Your focus determines your reality ✨",
     "One step at a time, one breath at a time 🧘",
@@ -37,7 +63,86 @@ MOTIVATIONAL_QUOTES = [
     "The successful warrior is the average person, with laser-like focus 🗡️",
     "Stay present. Stay focused. Stay calm 🌊",
     "Deep work leads to deep rewards 📚"
-]
+)
+
+# Each quote's JSON response is encoded once at import time, so /quotes only
+# has to pick a pre-serialized blob
+_QUOTE_RESPONSES = tuple(orjson.dumps({"quote": q}) for q in MOTIVATIONAL_QUOTES)
+_QUOTE_INDICES = range(len(MOTIVATIONAL_QUOTES))
+
+# Picking quotes one at a time with random.choice is surprisingly costly on the
+# hot GET path, so draw them in batches and hand them out from a deque
+_QUOTE_BUFFER = deque()
+
+def _next_quote_index():
+    """Return a random quote index, refilling the pre-drawn batch on empty"""
+    try:
+        return _QUOTE_BUFFER.popleft()
+    except IndexError:
+        _QUOTE_BUFFER.extend(random.choices(_QUOTE_INDICES, k=1024))
+        return _QUOTE_BUFFER.popleft()
+
+def _next_quote():
+    """Return a random quote"""
+    return MOTIVATIONAL_QUOTES[_next_quote_index()]
+
+# Insert batching: session creations are enqueued and written out in the
+# background, so the endpoint responds without waiting on a MongoDB
+# round-trip and N inserts collapse into one insert_many. Schedules are not
+# queued: they're rare writes that readers expect to see immediately
+INSERT_BATCH_SIZE = 500
+INSERT_FLUSH_INTERVAL = 0.05  # seconds
+
+session_insert_queue = asyncio.Queue()
+_insert_workers = []
+
+# Stats only change when a session completes, so serve dashboard reads from a
+# process-local cache; completions invalidate their user's entry and the TTL
+# bounds staleness across workers
+stats_cache = TTLCache(maxsize=10_000, ttl=30)
+
+async def _insert_flush_worker(collection, queue):
+    """Drain queued documents and insert them in batches"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        try:
+            deadline = loop.time() + INSERT_FLUSH_INTERVAL
+            while len(batch) < INSERT_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await collection.insert_many(batch, ordered=False)
+        except asyncio.CancelledError:
+            # Shutdown: write out the batch this worker already holds,
+            # acknowledged so the write can't race the client close. A
+            # duplicate _id error just means the interrupted insert landed
+            try:
+                await collection.with_options(
+                    write_concern=WriteConcern(w=1)
+                ).insert_many(batch, ordered=False)
+            except Exception:
+                logger.exception("Failed to flush %d held inserts at shutdown", len(batch))
+            raise
+        except Exception:
+            logger.exception("Failed to flush %d queued inserts", len(batch))
+
+async def _drain_insert_queue(collection, queue):
+    """Synchronously flush whatever is still queued (used at shutdown)"""
+    batch = []
+    while not queue.empty():
+        batch.append(queue.get_nowait())
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+# userId arrives as a query parameter on every read endpoint; validating it
+# against a pre-compiled pattern rejects junk before it reaches MongoDB
+DEFAULT_USER = "default_user"
+UserIdQuery = Annotated[str, Query(max_length=64, pattern=r"^[\w-]{1,64}$")]
 
 # Define Models
 class FocusSession(BaseModel):
@@ -47,7 +152,7 @@ class FocusSession(BaseModel):
     duration: int  # in minutes
     completed: bool = False
     quote: str
-    createdAt: datetime = Field(default_factory=datetime.utcnow)
+    createdAt: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 class FocusSessionCreate(BaseModel):
     duration: int  # in minutes
@@ -59,11 +164,11 @@ class FocusSessionComplete(BaseModel):
 
 class UserStats(BaseModel):
     userId: str = "default_user"
-    totalHours: float = 0.0
+    totalMinutes: int = 0
     sessionsCount: int = 0
     currentStreak: int = 0
     lastSessionDate: Optional[datetime] = None
-    weeklyData: List[float] = Field(default_factory=lambda: [0.0] * 7)
+    weeklyMinutes: List[int] = Field(default_factory=lambda: [0] * 7)
 
 class Schedule(BaseModel):
     userId: str = "default_user"
@@ -71,7 +176,8 @@ class Schedule(BaseModel):
     days: List[str]  # ["Mon", "Tue", etc.]
     enabled: bool = True
     name: str
-    createdAt: datetime = Field(default_factory=datetime.utcnow)
+    createdAt: datetime = Field(default_factory=lambda: datetime.now(UTC))
+    updatedAt: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 class ScheduleCreate(BaseModel):
     time: str
@@ -85,127 +191,146 @@ async def root():
     return {"message": "NoScreen API"}
 
 @api_router.get("/quotes")
-async def get_random_quote():
+def get_random_quote():
     """Get a random motivational quote"""
-    return {"quote": random.choice(MOTIVATIONAL_QUOTES)}
+    # stale-while-revalidate lets intermediaries coalesce bursts while each
+    # revalidated request still gets a fresh quote
+    return Response(content=_QUOTE_RESPONSES[_next_quote_index()],
+                    media_type="application/json",
+                    headers={"Cache-Control": "public, max-age=0, stale-while-revalidate=60"})
 
 @api_router.post("/sessions/start")
 async def start_session(session_data: FocusSessionCreate):
     """Start a new focus session"""
-    quote = random.choice(MOTIVATIONAL_QUOTES)
+    quote = _next_quote()
     session = FocusSession(
         userId=session_data.userId,
-        startTime=datetime.utcnow(),
+        startTime=datetime.now(UTC),
         duration=session_data.duration,
         quote=quote
     )
     
-    result = await db.focus_sessions.insert_one(session.dict())
-    session_dict = session.dict()
-    session_dict["_id"] = str(result.inserted_id)
-    
-    return session_dict
+    doc = session.model_dump()
+    doc["_id"] = ObjectId()
+    await session_insert_queue.put(doc)
+
+    return {**doc, "_id": str(doc["_id"])}
 
 @api_router.post("/sessions/complete")
 async def complete_session(complete_data: FocusSessionComplete):
     """Complete a focus session and update stats"""
-    from bson import ObjectId
-    
-    # Find and update the session
-    session = await db.focus_sessions.find_one({"_id": ObjectId(complete_data.sessionId)})
+    # Mark the session completed and fetch its startTime in one round-trip
+    session_id = ObjectId(complete_data.sessionId)
+    end_time = datetime.now(UTC)
+    session = await db.focus_sessions.find_one_and_update(
+        {"_id": session_id, "completed": False},
+        {"$set": {"endTime": end_time, "completed": True}},
+        return_document=ReturnDocument.BEFORE,
+        projection={"startTime": 1}
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    end_time = datetime.utcnow()
-    await db.focus_sessions.update_one(
-        {"_id": ObjectId(complete_data.sessionId)},
-        {"$set": {"endTime": end_time, "completed": True}}
-    )
-    
-    # Calculate actual duration in hours
+
+    # The stats update below cannot run concurrently with the session write:
+    # it needs the startTime that find_one_and_update returns. Two serial
+    # round-trips is already the floor for this endpoint.
+    # Calculate actual duration in whole minutes; keeping stats integral
+    # avoids FP drift across thousands of increments
     start_time = session["startTime"]
-    actual_duration = (end_time - start_time).total_seconds() / 3600
-    
-    # Update user stats
-    stats = await db.user_stats.find_one({"userId": complete_data.userId})
-    
-    if not stats:
-        # Create new stats
-        stats = UserStats(userId=complete_data.userId)
-        stats.totalHours = actual_duration
-        stats.sessionsCount = 1
-        stats.currentStreak = 1
-        stats.lastSessionDate = end_time
-        
-        # Update weekly data (today)
-        day_of_week = end_time.weekday()
-        stats.weeklyData[day_of_week] += actual_duration
-        
-        await db.user_stats.insert_one(stats.dict())
-    else:
-        # Update existing stats
-        new_total_hours = stats["totalHours"] + actual_duration
-        new_sessions_count = stats["sessionsCount"] + 1
-        
-        # Calculate streak
-        last_session_date = stats.get("lastSessionDate")
-        current_streak = stats.get("currentStreak", 0)
-        
-        if last_session_date:
-            days_diff = (end_time.date() - last_session_date.date()).days
-            if days_diff == 0:
-                # Same day
-                current_streak = stats.get("currentStreak", 1)
-            elif days_diff == 1:
-                # Consecutive day
-                current_streak += 1
-            else:
-                # Streak broken
-                current_streak = 1
-        else:
-            current_streak = 1
-        
-        # Update weekly data
-        weekly_data = stats.get("weeklyData", [0.0] * 7)
-        day_of_week = end_time.weekday()
-        weekly_data[day_of_week] += actual_duration
-        
-        await db.user_stats.update_one(
-            {"userId": complete_data.userId},
-            {"$set": {
-                "totalHours": new_total_hours,
-                "sessionsCount": new_sessions_count,
-                "currentStreak": current_streak,
-                "lastSessionDate": end_time,
-                "weeklyData": weekly_data
-            }}
-        )
-    
-    return {"message": "Session completed", "duration": actual_duration}
+    actual_minutes = int((end_time - start_time).total_seconds() // 60)
+
+    # Update user stats server-side in a single atomic pipeline update.
+    # Totals and streak are computed by MongoDB, so there is no
+    # read-modify-write race between concurrent completions and
+    # the upsert covers the first-session case. The $add expressions are the
+    # pipeline form of $inc; the operator form can't be used here because the
+    # streak needs conditional logic, and the two forms can't be mixed
+    days_since_last = {"$dateDiff": {
+        "startDate": "$lastSessionDate", "endDate": end_time, "unit": "day"
+    }}
+    await db.user_stats.update_one(
+        {"userId": complete_data.userId},
+        [{"$set": {
+            "totalMinutes": {"$add": [{"$ifNull": ["$totalMinutes", 0]}, actual_minutes]},
+            "sessionsCount": {"$add": [{"$ifNull": ["$sessionsCount", 0]}, 1]},
+            "currentStreak": {"$switch": {
+                "branches": [
+                    # Same day: streak unchanged
+                    {"case": {"$eq": [days_since_last, 0]},
+                     "then": {"$ifNull": ["$currentStreak", 1]}},
+                    # Consecutive day: streak extended
+                    {"case": {"$eq": [days_since_last, 1]},
+                     "then": {"$add": [{"$ifNull": ["$currentStreak", 0]}, 1]}},
+                ],
+                # Streak broken (or first ever session)
+                "default": 1
+            }},
+            "lastSessionDate": end_time
+        }}],
+        upsert=True
+    )
+    stats_cache.pop(complete_data.userId, None)
+
+    return {"message": "Session completed", "duration": actual_minutes}
 
 @api_router.get("/sessions/history")
-async def get_session_history(userId: str = "default_user", limit: int = 50):
+async def get_session_history(userId: UserIdQuery = DEFAULT_USER, limit: int = 50):
     """Get session history for a user"""
+    # Clamp so a pathological ?limit= can't materialize the whole collection
+    # in one to_list allocation
+    limit = min(max(limit, 1), 500)
     sessions = await db.focus_sessions.find(
-        {"userId": userId}
-    ).sort("createdAt", -1).limit(limit).to_list(limit)
+        {"userId": userId},
+        projection={"startTime": 1, "endTime": 1, "duration": 1,
+                    "completed": 1, "quote": 1, "createdAt": 1}
+    ).sort("createdAt", -1).limit(limit).batch_size(100).to_list(limit)
     
     for session in sessions:
         session["_id"] = str(session["_id"])
     
     return sessions
 
+async def _weekly_minutes(userId: str, now: datetime):
+    """Aggregate this week's completed minutes per weekday (Monday-first)"""
+    start_of_week = (now - timedelta(days=now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    buckets = [0] * 7
+    cursor = db.focus_sessions.aggregate([
+        {"$match": {"userId": userId, "completed": True,
+                    "endTime": {"$gte": start_of_week}}},
+        {"$group": {
+            "_id": {"$dayOfWeek": "$endTime"},
+            "minutes": {"$sum": {"$toInt": {"$divide": [
+                {"$subtract": ["$endTime", "$startTime"]}, 60000]}}}
+        }}
+    ])
+    async for row in cursor:
+        # $dayOfWeek is 1=Sunday..7=Saturday; buckets are Monday-first
+        buckets[(row["_id"] + 5) % 7] = row["minutes"]
+    return buckets
+
 @api_router.get("/stats")
-async def get_stats(userId: str = "default_user"):
+async def get_stats(userId: UserIdQuery = DEFAULT_USER):
     """Get user statistics"""
-    stats = await db.user_stats.find_one({"userId": userId})
-    
+    cached = stats_cache.get(userId)
+    if cached is not None:
+        return cached
+
+    # The totals document and the weekly aggregation are independent reads,
+    # so overlap their round-trips
+    stats, weekly = await asyncio.gather(
+        db.user_stats.find_one({"userId": userId}),
+        _weekly_minutes(userId, datetime.now(UTC))
+    )
+
     if not stats:
         # Return default stats
-        default_stats = UserStats(userId=userId)
-        return default_stats.dict()
-    
+        default_stats = UserStats(userId=userId, weeklyMinutes=weekly)
+        return default_stats.model_dump()
+
     stats["_id"] = str(stats["_id"])
+    stats["weeklyMinutes"] = weekly
+    stats_cache[userId] = stats
     return stats
 
 @api_router.post("/schedules")
@@ -218,40 +343,58 @@ async def create_schedule(schedule_data: ScheduleCreate):
         name=schedule_data.name
     )
     
-    result = await db.schedules.insert_one(schedule.dict())
-    schedule_dict = schedule.dict()
-    schedule_dict["_id"] = str(result.inserted_id)
-    
-    return schedule_dict
+    doc = schedule.model_dump()
+    doc["_id"] = ObjectId()
+    await db.schedules.insert_one(doc)
+
+    return {**doc, "_id": str(doc["_id"])}
+
+async def _schedules_etag(userId: str):
+    """Build a weak ETag from shared DB state so every worker agrees.
+
+    Schedule count catches creates/deletes and the newest updatedAt catches
+    toggles, so any write changes the validator regardless of which worker
+    performed it or whether the process restarted since
+    """
+    agg = await db.schedules.aggregate([
+        {"$match": {"userId": userId}},
+        {"$group": {"_id": None, "count": {"$sum": 1},
+                    "latest": {"$max": {"$ifNull": ["$updatedAt", "$createdAt"]}}}}
+    ]).to_list(1)
+    if not agg:
+        return 'W/"empty"'
+    return f'W/"{agg[0]["count"]}-{agg[0]["latest"].timestamp()}"'
 
 @api_router.get("/schedules")
-async def get_schedules(userId: str = "default_user"):
+async def get_schedules(request: Request, userId: UserIdQuery = DEFAULT_USER):
     """Get all schedules for a user"""
+    etag = await _schedules_etag(userId)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+
     schedules = await db.schedules.find({"userId": userId}).to_list(100)
-    
+
     for schedule in schedules:
         schedule["_id"] = str(schedule["_id"])
-    
-    return schedules
+
+    return ORJSONResponse(schedules, headers={"ETag": etag})
 
 @api_router.delete("/schedules/{schedule_id}")
 async def delete_schedule(schedule_id: str):
     """Delete a schedule"""
-    from bson import ObjectId
-    
     result = await db.schedules.delete_one({"_id": ObjectId(schedule_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Schedule not found")
-    
+
     return {"message": "Schedule deleted"}
 
 @api_router.patch("/schedules/{schedule_id}/toggle")
 async def toggle_schedule(schedule_id: str):
     """Toggle schedule enabled status"""
-    from bson import ObjectId
-    
-    schedule = await db.schedules.find_one({"_id": ObjectId(schedule_id)})
+    schedule = await db.schedules.find_one(
+        {"_id": ObjectId(schedule_id)}, projection={"enabled": 1}
+    )
     if not schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
     
@@ -259,9 +402,10 @@ async def toggle_schedule(schedule_id: str):
     
     await db.schedules.update_one(
         {"_id": ObjectId(schedule_id)},
-        {"$set": {"enabled": new_status}}
+        {"$set": {"enabled": new_status},
+         "$currentDate": {"updatedAt": True}}
     )
-    
+
     return {"enabled": new_status}
 
 # Include the router in the main app
@@ -282,6 +426,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    """Index the hot query keys so user lookups are IXSCANs, not COLLSCANs"""
+    await db.focus_sessions.create_index([("userId", 1), ("createdAt", -1)])
+    await db.user_stats.create_index("userId", unique=True)
+    await db.schedules.create_index("userId")
+
+@app.on_event("startup")
+async def start_insert_workers():
+    _insert_workers.append(asyncio.create_task(
+        _insert_flush_worker(sessions_unacked, session_insert_queue)))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for worker in _insert_workers:
+        worker.cancel()
+    await asyncio.gather(*_insert_workers, return_exceptions=True)
+    await _drain_insert_queue(db.focus_sessions, session_insert_queue)
     client.close()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools replace the stdlib event loop and HTTP parser with
+    # compiled implementations; 2x CPU workers suits this I/O-bound app
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=2 * (os.cpu_count() or 1),
+    )